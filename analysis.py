@@ -1,3 +1,5 @@
+import collections
+from scipy.special import comb
 import scipy.stats as stats
 import pandas as pd
 import seaborn as sns
@@ -256,3 +258,120 @@ def run_regression_analysis(coins, order=1):
         print('Error {} occurred during data retrieve/analysis'.format(e))
 
 
+def _fit_polynomials(x, Y, order):
+    """
+    least squares fit of every column of Y on polynomial of x, in one solve
+
+    x is standardized before building the design matrix to keep it well
+    conditioned, coefficients and their covariance are mapped back to raw x
+
+    Returns:
+        coef - (order + 1, k) coefficients, constant first
+        std_err - (order + 1, k)
+        r2 - (k,), NaN for constant columns of Y
+    """
+    n, p = x.shape[0], order + 1
+    mu, sd = x.mean(), x.std()
+    if sd == 0:
+        raise ValueError('Independent variable is constant!')
+    if n <= p:
+        raise ValueError('{} observations are too few for polynomial of order {}!'.format(n, order))
+
+    design = np.vander((x - mu) / sd, p, increasing=True)
+    q, r = np.linalg.qr(design)
+    coef_z = np.linalg.solve(r, q.T.dot(Y))
+
+    residuals = Y - design.dot(coef_z)
+    rss = (residuals ** 2).sum(axis=0)
+    tss = ((Y - Y.mean(axis=0)) ** 2).sum(axis=0)
+    sigma2 = rss / (n - p)
+
+    # raw coefficient i collects binomial terms of ((x - mu) / sd) ** j, j >= i
+    transform = np.zeros((p, p))
+    for j in range(p):
+        for i in range(j + 1):
+            transform[i, j] = comb(j, i) * (-mu) ** (j - i) / sd ** j
+
+    r_inv = np.linalg.inv(r)
+    unscaled_cov = transform.dot(r_inv).dot(r_inv.T).dot(transform.T)
+
+    # r2 is undefined for a constant dependent variable
+    constant = tss == 0
+    r2 = np.full(tss.shape, np.nan)
+    r2[~constant] = 1 - rss[~constant] / tss[~constant]
+
+    coef = transform.dot(coef_z)
+    std_err = np.sqrt(np.outer(np.diag(unscaled_cov), sigma2))
+    return coef, std_err, r2
+
+
+def batch_regression(data, pairs=None, base=None, orders=(1,)):
+    """
+    Fits dependent = b0 + b1 * x + ... + bk * x^k for many market pairs
+    at several polynomial orders, without plotting.
+    All dependents of one independent market are solved together.
+
+    Arguments:
+        data - aligned close matrix, as returned by get_market_data_by_list
+        pairs - (independent, dependent) market pairs
+        base - market used as independent variable for every other market
+        when neither pairs nor base is given, every pair of markets is fitted
+
+    Returns:
+        DataFrame with columns x, y, order, term, coef, std_err, r2, n_obs,
+        one row per coefficient (term 0 is constant)
+    """
+    data = data.drop('time', axis=1, errors='ignore').dropna()
+    markets = list(data.columns)
+
+    if pairs is None:
+        if base is not None:
+            pairs = [(base, market) for market in markets if market != base]
+        else:
+            pairs = [(markets[i], markets[j])
+                     for i in range(len(markets)) for j in range(i + 1, len(markets))]
+
+    dependents = collections.OrderedDict()
+    for x_name, y_name in pairs:
+        dependents.setdefault(x_name, []).append(y_name)
+
+    rows = []
+    for x_name, y_names in dependents.items():
+        x = data[x_name].values.astype(np.float64)
+        Y = data[y_names].values.astype(np.float64)
+        for order in orders:
+            coef, std_err, r2 = _fit_polynomials(x, Y, order)
+            for k, y_name in enumerate(y_names):
+                for term in range(order + 1):
+                    rows.append((x_name, y_name, order, term,
+                                 coef[term, k], std_err[term, k], r2[k], x.shape[0]))
+
+    return pd.DataFrame(rows, columns=['x', 'y', 'order', 'term', 'coef', 'std_err', 'r2', 'n_obs'])
+
+
+def plot_batch_regression(data, table):
+    """
+    plots regression line of every pair and order from batch_regression table
+    """
+    for (x_name, y_name, order), _ in table.groupby(['x', 'y', 'order'], sort=False):
+        plot_regression_line(data[x_name], data[y_name], order=order)
+
+
+def run_batch_regression_analysis(coins=None, base=None, orders=(1, 2, 3), plot=False):
+    """
+    headless counterpart of run_regression_analysis:
+    fetches aligned closes once and fits all pairs of coins,
+    or every coin containing base against base market (e.g. USDT-BTC)
+    """
+    if coins is not None:
+        data = get_market_data_by_list(coins)
+    elif base is not None:
+        data = get_market_data_containing(base.split('-')[0])
+    else:
+        raise ValueError('Coins or base must be provided!')
+
+    data.drop('time', axis=1, inplace=True)
+    table = batch_regression(data, base=base, orders=orders)
+    if plot:
+        plot_batch_regression(data, table)
+    return table
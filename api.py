@@ -0,0 +1,341 @@
+#!/usr/bin/python
+"""
+Read-only candles API on the database Flask app.
+
+    GET /candles/<market>?start=&end=&timeframe=OneMin&page=1&per_page=1000
+    GET /closes?markets=USDT-BTC,USDT-ETH   (or ?contains=USDT)
+    GET /correlation?contains=USDT&method=pearson&window=1440
+    GET /metrics
+
+start/end are epoch seconds or ISO times, timeframe is one of TICK_INTERVALS
+values. Data endpoints answer columnar JSON by default, or Arrow IPC stream /
+Parquet with format=arrow|parquet (or the matching Accept header) when
+pyarrow is installed. Responses carry an ETag and are gzipped on request.
+
+Results are cached in process and dropped as soon as the ingestion watermark
+(newest ticker id) moves, so repeated dashboard calls cost one query per
+ingest.
+"""
+import collections
+import gzip
+import hashlib
+import json
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+from flask import Response, request
+
+import metrics
+from bittrex import TICK_INTERVALS
+from database import app, Markets, Tickers
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+
+TIMEFRAMES = {TICK_INTERVALS['One_Minute']: None,
+              TICK_INTERVALS['Five_Minutes']: '5min',
+              TICK_INTERVALS['Thirty_Minutes']: '30min',
+              TICK_INTERVALS['Hour']: '60min',
+              TICK_INTERVALS['Day']: '1D'}
+
+CANDLE_COLUMNS = ['time', 'high', 'low', 'close', 'volume']
+
+CONTENT_TYPES = {'json': 'application/json',
+                 'arrow': 'application/vnd.apache.arrow.stream',
+                 'parquet': 'application/vnd.apache.parquet'}
+
+DEFAULT_PER_PAGE = 1000
+MAX_PER_PAGE = 100000
+GZIP_MIN_SIZE = 1024
+
+CACHE_SIZE = 256
+# seconds the watermark is trusted before it is queried again
+WATERMARK_TTL = 5
+
+
+class ApiError(Exception):
+    def __init__(self, message, status=400):
+        super(ApiError, self).__init__(message)
+        self.message = message
+        self.status = status
+
+
+class ResultCache(object):
+    """
+    encoded responses keyed by request, valid for one ingestion watermark
+    """
+
+    def __init__(self, size=CACHE_SIZE, ttl=WATERMARK_TTL):
+        self.size = size
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()
+        self.watermark = None
+        self.checked_at = 0
+        self.lock = threading.Lock()
+
+    def _refresh_watermark(self):
+        now = time.time()
+        if now - self.checked_at < self.ttl:
+            return
+        watermark = Tickers.get_last_id()
+        self.checked_at = now
+        if watermark != self.watermark:
+            self.watermark = watermark
+            self.entries.clear()
+
+    def get(self, key, compute):
+        with self.lock:
+            self._refresh_watermark()
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                metrics.incr('api.cache_hits')
+                return self.entries[key]
+            watermark = self.watermark
+
+        metrics.incr('api.cache_misses')
+        value = compute()
+        with self.lock:
+            # computed before an ingest the cache has seen since, serve it once only
+            if self.watermark == watermark:
+                self.entries[key] = value
+                while len(self.entries) > self.size:
+                    self.entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.checked_at = 0
+
+
+cache = ResultCache()
+
+
+def _parse_time(value):
+    if value is None:
+        return None
+    try:
+        if value.isdigit():
+            return pd.to_datetime(int(value), unit='s', utc=True)
+        return pd.to_datetime(value, utc=True)
+    except ValueError:
+        raise ApiError('Incorrect time {}!'.format(value))
+
+
+def _int_arg(name, default, minimum=1, maximum=None):
+    try:
+        value = int(request.args.get(name, default))
+    except ValueError:
+        raise ApiError('{} must be an integer!'.format(name))
+    if value < minimum or (maximum is not None and value > maximum):
+        raise ApiError('{} out of range!'.format(name))
+    return value
+
+
+def _response_format():
+    fmt = request.args.get('format')
+    if fmt is None:
+        accepted = request.accept_mimetypes
+        fmt = max(CONTENT_TYPES, key=lambda name: accepted[CONTENT_TYPES[name]])
+        if not accepted[CONTENT_TYPES[fmt]]:
+            fmt = 'json'
+    if fmt not in CONTENT_TYPES:
+        raise ApiError('Unknown format {}, use one of {}!'.format(fmt, ', '.join(CONTENT_TYPES)))
+    if fmt != 'json' and pa is None:
+        raise ApiError('{} responses need pyarrow installed!'.format(fmt), status=406)
+    return fmt
+
+
+def _epoch_seconds(times):
+    return pd.to_datetime(times, utc=True).values.astype('datetime64[s]').astype(np.int64)
+
+
+def _column(values):
+    values = np.asarray(values)
+    if values.dtype.kind == 'f' and np.isnan(values).any():
+        return [None if np.isnan(v) else v for v in values.tolist()]
+    return values.tolist()
+
+
+def _encode(df, fmt, extra=None):
+    """
+    DataFrame as columnar JSON ({'columns': {name: [...]}, ...extra}),
+    Arrow IPC stream or Parquet, time columns as epoch seconds
+    """
+    if 'time' in df.columns:
+        df = df.copy()
+        df['time'] = _epoch_seconds(df['time'])
+
+    if fmt == 'json':
+        body = dict(extra or {})
+        body['columns'] = collections.OrderedDict((str(name), _column(df[name])) for name in df.columns)
+        return json.dumps(body).encode()
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    if fmt == 'arrow':
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+    else:
+        pq.write_table(table, sink)
+    return sink.getvalue().to_pybytes()
+
+
+def _paginate(df):
+    per_page = _int_arg('per_page', DEFAULT_PER_PAGE, maximum=MAX_PER_PAGE)
+    page = _int_arg('page', 1)
+    pages = max(1, -(-df.shape[0] // per_page))
+    info = {'page': page, 'per_page': per_page, 'pages': pages, 'rows': int(df.shape[0])}
+    return df.iloc[(page - 1) * per_page:page * per_page], info
+
+
+def _respond(compute):
+    """
+    serves cached (body, etag, gzipped body) of current request,
+    compute returns (DataFrame, extra JSON fields)
+    """
+    fmt = _response_format()
+    key = (request.path, tuple(sorted(request.args.items(multi=True))), fmt)
+
+    def build():
+        df, extra = compute()
+        body = _encode(df, fmt, extra)
+        return body, hashlib.sha1(body).hexdigest(), gzip.compress(body) if len(body) >= GZIP_MIN_SIZE else None
+
+    body, etag, compressed = cache.get(key, build)
+    response = Response(body, content_type=CONTENT_TYPES[fmt])
+    # format is negotiated from Accept, compression from Accept-Encoding
+    response.headers['Vary'] = 'Accept, Accept-Encoding'
+    if compressed is not None and 'gzip' in request.accept_encodings:
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = 'gzip'
+        etag += '-gzip'
+    response.set_etag(etag)
+    return response.make_conditional(request)
+
+
+def _market_id(market_name):
+    market = Markets.query.filter_by(market_name=market_name).first()
+    if market is None:
+        raise ApiError('Unknown market {}!'.format(market_name), status=404)
+    return market.id
+
+
+def _market_closes(market_id, start, end):
+    """
+    closes of market between start and end, one per candle
+    """
+    df = Tickers.get_with_market_id_between(market_id, start, end)
+    # collector re-fetches overlapping history, keep the last copy of every candle
+    df = df.drop_duplicates('time', keep='last')[['time', 'close']]
+    # PostgreSQL returns aware times, sqlite naive UTC ones
+    df['time'] = pd.to_datetime(df['time'], utc=True)
+    return df.set_index('time')['close']
+
+
+def _close_matrix():
+    """
+    closes of requested markets aligned on common times, like get_collected_data
+    does it, with start/end applied in the query
+    """
+    if request.args.get('markets'):
+        markets = Markets.get_market_id_with_names(request.args['markets'].split(','))
+    elif request.args.get('contains'):
+        markets = Markets.get_market_name_contains(request.args['contains'])
+    else:
+        raise ApiError('markets or contains must be provided!')
+
+    start, end = _parse_time(request.args.get('start')), _parse_time(request.args.get('end'))
+    closes = [_market_closes(row['id'], start, end).rename(row['market_name'])
+              for _, row in markets.iterrows()]
+    data = pd.concat(closes, axis=1, join='inner') if closes else pd.DataFrame()
+    if data.empty:
+        raise ApiError('No data for requested markets!', status=404)
+
+    # time first, then markets
+    return data.sort_index().rename_axis('time').reset_index()
+
+
+def resample(df, timeframe):
+    """
+    one minute candles aggregated to given timeframe
+    """
+    if timeframe not in TIMEFRAMES:
+        raise ApiError('Unknown timeframe {}, use one of {}!'.format(timeframe, ', '.join(TIMEFRAMES)))
+    rule = TIMEFRAMES[timeframe]
+    if rule is None or df.empty:
+        return df
+
+    df = df.set_index('time').resample(rule).agg({'high': 'max',
+                                                  'low': 'min',
+                                                  'close': 'last',
+                                                  'volume': 'sum'})
+    return df.dropna(subset=['close']).reset_index()[CANDLE_COLUMNS]
+
+
+@app.errorhandler(ApiError)
+def handle_api_error(error):
+    return Response(json.dumps({'message': error.message}),
+                    status=error.status,
+                    content_type=CONTENT_TYPES['json'])
+
+
+@app.route('/candles/<market_name>')
+def candles(market_name):
+    def compute():
+        with metrics.span('api.candles'):
+            df = Tickers.get_with_market_id_between(_market_id(market_name),
+                                                    _parse_time(request.args.get('start')),
+                                                    _parse_time(request.args.get('end')))
+            # collector re-fetches overlapping history, keep the last copy of every candle
+            df = df.drop_duplicates('time', keep='last')[CANDLE_COLUMNS]
+            timeframe = request.args.get('timeframe', TICK_INTERVALS['One_Minute'])
+            df, info = _paginate(resample(df, timeframe))
+            info.update(market=market_name, timeframe=timeframe)
+            return df, info
+
+    return _respond(compute)
+
+
+@app.route('/closes')
+def closes():
+    def compute():
+        with metrics.span('api.closes'):
+            return _paginate(_close_matrix())
+
+    return _respond(compute)
+
+
+@app.route('/correlation')
+def correlation():
+    def compute():
+        with metrics.span('api.correlation'):
+            method = request.args.get('method', 'pearson')
+            if method not in ('pearson', 'kendall', 'spearman'):
+                raise ApiError('Unknown correlation method {}!'.format(method))
+
+            data = _close_matrix()
+            if request.args.get('window'):
+                data = data.tail(_int_arg('window', None))
+            matrix = data.drop('time', axis=1).corr(method=method)
+            matrix.insert(0, 'market', matrix.index)
+            return matrix, {'method': method,
+                            'rows': int(data.shape[0]),
+                            'until': int(_epoch_seconds(data['time'])[-1]) if data.shape[0] else None}
+
+    return _respond(compute)
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.to_prometheus(), content_type='text/plain; version=0.0.4')
+
+
+if __name__ == '__main__':
+    app.run()
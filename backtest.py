@@ -0,0 +1,182 @@
+#!/usr/bin/python
+"""
+Vectorized multi-market backtester.
+
+Works on a time x market close matrix and a matching signal matrix
+(CryptoClassifier predictions or any other signal). A position held at
+candle t earns the return from t to t+1, which is what the classifier
+predicts. Every position change pays fee + slippage on the traded amount.
+
+    close, signals = classifier_signals(CryptoClassifier(), ['USDT-BTC', 'USDT-ETH'])
+    result = run_backtest(close.values, positions_from_signals(signals.values))
+    print(summary(result, close.columns))
+
+backtest_grid evaluates many thresholds/fees/slippages over all markets,
+every run is vectorized over the whole time x market matrix.
+"""
+import collections
+import itertools
+
+import numpy as np
+import pandas as pd
+
+import metrics
+
+
+# minute candles
+PERIODS_PER_YEAR = 365 * 24 * 60
+# bittrex taker/maker fee
+BITTREX_FEE = 0.0025
+
+
+BacktestResult = collections.namedtuple('BacktestResult', [
+    'returns',        # (T-1, M) strategy returns after costs
+    'equity',         # (T-1, M) equity curve per market, starting from 1
+    'drawdown',       # (T-1, M) relative drop from running equity peak
+    'total_return',   # (M,)
+    'sharpe',         # (M,) annualized
+    'max_drawdown',   # (M,)
+    'turnover',       # (M,) summed absolute position changes
+    'exposure',       # (M,) share of candles with open position
+    'portfolio',      # (T-1,) equity of equally weighted portfolio over markets
+])
+
+
+def positions_from_signals(signals, threshold=0.5, allow_short=False):
+    """
+    maps signals (classes 0/1 or up probabilities) to positions:
+        1 - long when signal > threshold
+       -1 - short when signal < 1 - threshold and shorting is allowed
+        0 - otherwise, also for missing (NaN) signals
+    """
+    signals = np.asarray(signals, dtype=np.float64)
+    positions = (signals > threshold).astype(np.float64)
+    if allow_short:
+        positions -= signals < 1 - threshold
+    return positions
+
+
+def _returns(close):
+    # gaps carry the last close, the move across a gap is booked when the market trades again
+    close = pd.DataFrame(np.asarray(close, dtype=np.float64)).ffill().values
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns = close[1:] / close[:-1] - 1
+    # candles before the first close earn nothing
+    returns[~np.isfinite(returns)] = 0
+    return returns
+
+
+def _sharpe(returns, periods_per_year):
+    std = returns.std(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sharpe = returns.mean(axis=0) / std * np.sqrt(periods_per_year)
+    sharpe[std == 0] = 0
+    return sharpe
+
+
+def _trades(positions, returns):
+    """
+    held positions, their changes (including opening the first one)
+    and returns before costs
+    """
+    held = np.nan_to_num(np.asarray(positions, dtype=np.float64))[:-1]
+    turnover = np.abs(np.diff(np.concatenate((np.zeros_like(held[:1]), held)), axis=0))
+    return held, turnover, held * returns
+
+
+def _evaluate(held, turnover, gross, cost, periods_per_year):
+    strategy = gross - turnover * cost
+    equity = np.cumprod(1 + strategy, axis=0)
+    drawdown = equity / np.maximum.accumulate(equity, axis=0) - 1
+
+    return BacktestResult(returns=strategy,
+                          equity=equity,
+                          drawdown=drawdown,
+                          total_return=equity[-1] - 1,
+                          sharpe=_sharpe(strategy, periods_per_year),
+                          max_drawdown=drawdown.min(axis=0),
+                          turnover=turnover.sum(axis=0),
+                          exposure=(held != 0).mean(axis=0),
+                          portfolio=np.cumprod(1 + strategy.mean(axis=1)))
+
+
+def run_backtest(close, positions, fee=BITTREX_FEE, slippage=0.0, periods_per_year=PERIODS_PER_YEAR):
+    """
+    Arguments:
+        close - (T, M) close prices, markets in columns, NaN for missing candles
+        positions - (T, M) position per candle, fraction of market allocation
+        fee, slippage - cost per unit of traded position
+
+    Returns:
+        BacktestResult
+    """
+    held, turnover, gross = _trades(positions, _returns(close))
+    return _evaluate(held, turnover, gross, fee + slippage, periods_per_year)
+
+
+def summary(result, markets):
+    """
+    per market statistics of BacktestResult as DataFrame
+    """
+    return pd.DataFrame({'total_return': result.total_return,
+                         'sharpe': result.sharpe,
+                         'max_drawdown': result.max_drawdown,
+                         'turnover': result.turnover,
+                         'exposure': result.exposure},
+                        index=pd.Index(markets, name='market'),
+                        columns=['total_return', 'sharpe', 'max_drawdown', 'turnover', 'exposure'])
+
+
+def backtest_grid(close, signals, markets, thresholds=(0.5,), fees=(BITTREX_FEE,),
+                  slippages=(0.0,), allow_short=False, periods_per_year=PERIODS_PER_YEAR):
+    """
+    runs backtest for every threshold/fee/slippage combination,
+    returns summary of every (combination, market) in one DataFrame
+    """
+    with metrics.span('backtest.grid'):
+        returns = _returns(close)
+        tables = []
+        for threshold in thresholds:
+            held, turnover, gross = _trades(positions_from_signals(signals, threshold, allow_short), returns)
+            for fee, slippage in itertools.product(fees, slippages):
+                result = _evaluate(held, turnover, gross, fee + slippage, periods_per_year)
+                table = summary(result, markets).reset_index()
+                table.insert(0, 'slippage', slippage)
+                table.insert(0, 'fee', fee)
+                table.insert(0, 'threshold', threshold)
+                tables.append(table)
+
+    metrics.incr('backtest.runs', len(tables) * len(markets))
+    return pd.concat(tables, ignore_index=True)
+
+
+def classifier_signals(clf, market_names, fetch=None):
+    """
+    close and signal matrices (time x market) from CryptoClassifier predictions,
+    fetch(market) returns close/volume/time data, get_coin_data_all by default
+    """
+    if fetch is None:
+        from get_collected_data import get_coin_data_all
+        fetch = get_coin_data_all
+
+    closes, signals = {}, {}
+    for market in market_names:
+        data = fetch(market).drop_duplicates('time', keep='last').sort_values('time').reset_index(drop=True)
+        prediction = clf.predict(data)
+        times = data.loc[prediction.index, 'time']
+        closes[market] = pd.Series(data['close'].values, index=data['time'])
+        signals[market] = pd.Series(prediction.values, index=times)
+
+    # gaps of a market carry the last close, the move is booked when it trades again
+    close = pd.DataFrame(closes, columns=list(market_names)).sort_index().ffill()
+    signal = pd.DataFrame(signals, columns=list(market_names)).reindex(close.index)
+    return close, signal
+
+
+if __name__ == '__main__':
+    from classifier import CryptoClassifier
+
+    markets = ['USDT-BTC', 'USDT-ETH', 'USDT-LTC']
+    close, signals = classifier_signals(CryptoClassifier(), markets)
+    print(backtest_grid(close.values, signals.values, markets,
+                        fees=(0, BITTREX_FEE), slippages=(0, 0.001)))
@@ -3,6 +3,7 @@ import hmac
 import requests
 from urllib.parse import urlencode
 import hashlib
+import metrics
 
 BITTREX_BASE = 'https://bittrex.com/api/v2.0/{method_set}/{method}?'
 EMPTY_VALUE = ''
@@ -15,11 +16,28 @@ TICK_INTERVALS = {'One_Minute': 'OneMin',
                   'Day': 'Day'}
 
 
+def _get(request_url, apisign):
+    with metrics.span('bittrex.request'):
+        response = requests.get(
+            request_url,
+            headers={"apisign": apisign},
+            timeout=60)
+    metrics.incr('bittrex.requests')
+    metrics.incr('bittrex.bytes_received', len(response.content))
+    return response
+
+
 def using_requests(request_url, apisign):
-    return requests.get(
-        request_url,
-        headers={"apisign": apisign},
-        timeout=60).json()
+    response = _get(request_url, apisign)
+    with metrics.span('bittrex.json_decode'):
+        return response.json()
+
+
+def using_requests_raw(request_url, apisign):
+    """
+    undecoded response body, for callers with their own decoder
+    """
+    return _get(request_url, apisign).content
 
 
 class Bittrex(object):
@@ -28,14 +46,18 @@ class Bittrex(object):
     providing api_key, api_secret, additional (except public) api calls can be performed
     """
 
-    def __init__(self, api_key=None, api_secret=None, dispatch=using_requests):
+    def __init__(self, api_key=None, api_secret=None, dispatch=using_requests,
+                 raw_dispatch=using_requests_raw):
         self.api_key = str(api_key) if api_key else EMPTY_VALUE
         self.api_secret = str(api_secret) if api_secret else EMPTY_VALUE
         self.dispatch = dispatch
+        self.raw_dispatch = raw_dispatch
 
-    def api_query(self, method, options=None):
+    @metrics.timed('bittrex.api_query')
+    def api_query(self, method, options=None, raw=False):
         """
-        query frame for calling different api methods
+        query frame for calling different api methods,
+        with raw=True response body is returned undecoded
         """
 
         if not options:
@@ -57,6 +79,8 @@ class Bittrex(object):
                            request_url.encode(),
                            hashlib.sha512).hexdigest()
 
+        if raw:
+            return self.raw_dispatch(request_url, apisign)
         return self.dispatch(request_url, apisign)
 
     def get_markets(self):
@@ -113,9 +137,10 @@ class Bittrex(object):
         return [market for market in self.get_markets()
                 if market.lower().startswith(currency.lower())]
 
-    def get_candles(self, market, tick_interval):
+    def get_candles(self, market, tick_interval, raw=False):
         """
         Used to get all tick candle for a market.
+        With raw=True response body is returned as bytes, see tick_decoder.
 
         Endpoint: pub/market/GetTicks
 
@@ -142,5 +167,6 @@ class Bittrex(object):
 
         return self.api_query(method='/market/GetTicks',
                               options={'marketName': market,
-                                       'tickInterval': tick_interval})
+                                       'tickInterval': tick_interval},
+                              raw=raw)
 
@@ -0,0 +1,412 @@
+#!/usr/bin/python
+"""
+Array-backed candle store shared between processes.
+
+Every market is one multiprocessing.shared_memory block holding columnar
+arrays: int64 epoch seconds plus open/high/low/close/volume as float32
+or float64. Blocks are ring buffers, so a live market keeps its last
+`capacity` candles. A small manifest block maps market names to blocks.
+
+There is a single writer (the collector, or `python candle_store.py publish`),
+and any number of readers attached by store name. Readers get numpy views
+without copying, and DataFrames through the same functions get_collected_data
+exposes:
+
+    store = CandleStore.attach()
+    store.columns('USDT-BTC')['close']          # zero-copy view, until buffer wraps
+    store.get_market_data_containing('USDT')     # same frame as get_collected_data
+
+Segments outlive the processes using them, like files in /dev/shm,
+until CandleStore.unlink() (`python candle_store.py unlink`).
+"""
+import json
+import os
+import sys
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+import pandas as pd
+
+
+STORE_ENV = 'CRYPTO_CANDLE_STORE'
+DEFAULT_NAME = 'crypto_candles'
+# 30 days of minute candles
+DEFAULT_CAPACITY = 30 * 24 * 60
+
+FIELDS = ('open', 'high', 'low', 'close', 'volume')
+
+MANIFEST_SIZE = 1 << 20
+# manifest header: [version, json length], version is odd while being written
+MANIFEST_HEADER = 2
+# market header: [capacity, total appended, total reserved],
+# writer reserves slots before overwriting them and publishes them afterwards
+MARKET_HEADER = 3
+
+
+def _unregister(shm):
+    # segments are owned by the store, not the process,
+    # otherwise resource tracker would unlink them when any process exits
+    try:
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    except Exception:
+        pass
+
+
+def _create_segment(name, size):
+    shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+    _unregister(shm)
+    return shm
+
+
+def _attach_segment(name):
+    shm = shared_memory.SharedMemory(name=name)
+    _unregister(shm)
+    return shm
+
+
+# segments closed while readers still hold views into them
+_lingering = []
+
+
+def _close_segment(shm):
+    try:
+        shm.close()
+    except BufferError:
+        # views handed out to readers are still alive, keep the mapping for them
+        _lingering.append(shm)
+
+
+def to_epoch_seconds(values):
+    """
+    int64 epoch seconds from epoch integers, datetimes or ISO time strings
+    (as returned by GetTicks)
+    """
+    values = np.asarray(values)
+    if values.dtype.kind in 'iu':
+        return values.astype(np.int64, copy=False)
+    if values.dtype.kind == 'M':
+        return values.astype('datetime64[s]').astype(np.int64)
+    return pd.to_datetime(values, utc=True).values.astype('datetime64[s]').astype(np.int64)
+
+
+class MarketCandles(object):
+    """
+    columnar ring buffer of one market inside a shared memory block
+    """
+
+    def __init__(self, shm, dtype):
+        self.shm = shm
+        self.dtype = np.dtype(dtype)
+        # frombuffer views pin the mapping, it can't be unmapped under a reader
+        self.header = np.frombuffer(shm.buf, dtype=np.int64, count=MARKET_HEADER)
+        self.capacity = int(self.header[0])
+
+        offset = self.header.nbytes
+        self.time = np.frombuffer(shm.buf, dtype=np.int64, count=self.capacity, offset=offset)
+        offset += self.time.nbytes
+        self.fields = {}
+        for field in FIELDS:
+            self.fields[field] = np.frombuffer(shm.buf, dtype=self.dtype, count=self.capacity, offset=offset)
+            offset += self.fields[field].nbytes
+
+    @staticmethod
+    def size(capacity, dtype):
+        return (MARKET_HEADER + capacity) * 8 + len(FIELDS) * capacity * np.dtype(dtype).itemsize
+
+    @classmethod
+    def create(cls, name, capacity, dtype):
+        shm = _create_segment(name, cls.size(capacity, dtype))
+        header = np.frombuffer(shm.buf, dtype=np.int64, count=MARKET_HEADER)
+        header[:] = [capacity, 0, 0]
+        del header
+        return cls(shm, dtype)
+
+    @property
+    def written(self):
+        return int(self.header[1])
+
+    def __len__(self):
+        return min(self.written, self.capacity)
+
+    def last_time(self):
+        written = self.written
+        if not written:
+            return None
+        return int(self.time[(written - 1) % self.capacity])
+
+    def append(self, candles):
+        """
+        appends candles newer than the last stored one,
+        candles - mapping (dict, DataFrame) with 'time' and FIELDS columns,
+                  missing fields are stored as NaN
+
+        returns number of appended candles
+        """
+        all_times = to_epoch_seconds(candles['time'])
+        order = np.argsort(all_times, kind='mergesort')
+        times = all_times[order]
+
+        last = self.last_time()
+        keep = np.ones(times.shape[0], dtype=bool) if last is None else times > last
+        # drop duplicates inside the batch as well
+        keep[1:] &= times[1:] != times[:-1]
+        rows = order[keep][-self.capacity:]
+        if not rows.shape[0]:
+            return 0
+
+        written = self.written
+        # reserved first, readers copying the slots below retry
+        self.header[2] = written + rows.shape[0]
+        positions = (written + np.arange(rows.shape[0])) % self.capacity
+        self.time[positions] = all_times[rows]
+        for field in FIELDS:
+            if field in candles:
+                self.fields[field][positions] = np.asarray(candles[field], dtype=self.dtype)[rows]
+            else:
+                self.fields[field][positions] = np.nan
+
+        # published last, readers never see half written rows
+        self.header[1] = written + rows.shape[0]
+        return rows.shape[0]
+
+    def columns(self, copy=False):
+        """
+        dict of time and FIELDS arrays in chronological order
+
+        Views into shared memory are returned while the ring buffer has not
+        wrapped yet, unless copy is requested. They are only valid until the
+        buffer wraps: once more than capacity candles were appended in total,
+        the writer overwrites their slots in place. Copies are consistent,
+        they are taken again when the writer reserved slots being copied.
+        """
+        arrays = dict(self.fields, time=self.time)
+        if not copy:
+            written = self.written
+            if written <= self.capacity:
+                return {key: array[:written] for key, array in arrays.items()}
+
+        while True:
+            written = self.written
+            n = min(written, self.capacity)
+            start = written % self.capacity if written > self.capacity else 0
+            if start == 0:
+                result = {key: array[:n].copy() for key, array in arrays.items()}
+            else:
+                result = {key: np.concatenate((array[start:], array[:start])) for key, array in arrays.items()}
+
+            # oldest copied candle is number written - n, still there unless writer reserved its slot
+            if int(self.header[2]) - self.capacity <= written - n:
+                return result
+            time.sleep(0)
+
+    def close(self):
+        self.header = self.time = None
+        self.fields = {}
+        _close_segment(self.shm)
+
+
+class CandleStore(object):
+    """
+    per-market MarketCandles plus manifest, see module docstring
+    """
+
+    def __init__(self, name, manifest_shm, owner):
+        self.name = name
+        self.manifest_shm = manifest_shm
+        self.manifest_header = np.frombuffer(manifest_shm.buf, dtype=np.int64, count=MANIFEST_HEADER)
+        self.owner = owner
+        self.markets = {}
+        self.manifest = self._read_manifest()
+
+    @classmethod
+    def create(cls, name=DEFAULT_NAME, capacity=DEFAULT_CAPACITY, dtype=np.float64):
+        shm = _create_segment(name, MANIFEST_SIZE)
+        store = cls(name, shm, owner=True)
+        store._write_manifest({'capacity': capacity,
+                               'dtype': np.dtype(dtype).name,
+                               'markets': {}})
+        return store
+
+    @classmethod
+    def attach(cls, name=DEFAULT_NAME):
+        return cls(name, _attach_segment(name), owner=False)
+
+    @classmethod
+    def open(cls, name=DEFAULT_NAME, capacity=DEFAULT_CAPACITY, dtype=np.float64):
+        """
+        attaches to existing store or creates it, used by writers
+        """
+        try:
+            store = cls.attach(name)
+        except FileNotFoundError:
+            return cls.create(name, capacity, dtype)
+        store.owner = True
+        return store
+
+    def _read_manifest(self):
+        offset = self.manifest_header.nbytes
+        while True:
+            version = int(self.manifest_header[0])
+            if version % 2:
+                time.sleep(0)
+                continue
+            length = int(self.manifest_header[1])
+            raw = bytes(self.manifest_shm.buf[offset:offset + length])
+            if int(self.manifest_header[0]) == version:
+                return json.loads(raw.decode()) if length else {'markets': {}}
+
+    def _write_manifest(self, manifest):
+        raw = json.dumps(manifest).encode()
+        offset = self.manifest_header.nbytes
+        if offset + len(raw) > MANIFEST_SIZE:
+            raise ValueError('Candle store manifest is full!')
+
+        self.manifest_header[0] += 1
+        self.manifest_shm.buf[offset:offset + len(raw)] = raw
+        self.manifest_header[1] = len(raw)
+        self.manifest_header[0] += 1
+        self.manifest = manifest
+
+    def market_names(self):
+        self.manifest = self._read_manifest()
+        return list(self.manifest['markets'])
+
+    def market(self, market_name):
+        """
+        MarketCandles of given market, KeyError if market is not in the store
+        """
+        if market_name not in self.markets:
+            if market_name not in self.manifest['markets']:
+                self.manifest = self._read_manifest()
+            info = self.manifest['markets'][market_name]
+            self.markets[market_name] = MarketCandles(_attach_segment(info['segment']),
+                                                      self.manifest['dtype'])
+        return self.markets[market_name]
+
+    def append(self, market_name, market_id, candles):
+        """
+        appends candles to market, creating it on first use (writer only)
+        """
+        if not self.owner:
+            raise ValueError('Candle store attached read-only, use CandleStore.open to write!')
+
+        manifest = self._read_manifest()
+        if market_name not in manifest['markets']:
+            # market ids are reassigned by collect_markets, segments are numbered by store
+            segment = '{}_{}'.format(self.name, len(manifest['markets']))
+            self.markets[market_name] = MarketCandles.create(segment,
+                                                             manifest['capacity'],
+                                                             manifest['dtype'])
+            manifest['markets'][market_name] = {'id': int(market_id), 'segment': segment}
+            self._write_manifest(manifest)
+
+        return self.market(market_name).append(candles)
+
+    def columns(self, market_name, copy=False):
+        return self.market(market_name).columns(copy=copy)
+
+    def frame(self, market_name, fields=FIELDS):
+        """
+        DataFrame of market candles, shaped like tickers table rows
+        """
+        columns = self.columns(market_name, copy=True)
+        df = pd.DataFrame({field: columns[field] for field in fields}, columns=list(fields))
+        df['time'] = pd.to_datetime(columns['time'], unit='s', utc=True)
+        df['market_id'] = self.manifest['markets'][market_name]['id']
+        return df
+
+    def _close_matrix(self, market_names):
+        """
+        closes of given markets aligned on common times, like inner merge
+        get_collected_data does
+        """
+        df_all = pd.DataFrame()
+        if not market_names:
+            return df_all
+
+        # copies, columns are read several times below
+        columns = [self.columns(market_name, copy=True) for market_name in market_names]
+        common = columns[0]['time']
+        for market in columns[1:]:
+            common = np.intersect1d(common, market['time'], assume_unique=True)
+
+        for market_name, market in zip(market_names, columns):
+            df_all[market_name] = market['close'][np.searchsorted(market['time'], common)]
+            if df_all.shape[1] == 1:
+                df_all['time'] = pd.to_datetime(common, unit='s', utc=True)
+        return df_all
+
+    def get_coin_data_closing(self, coin):
+        return self.frame(coin).rename(columns={'close': coin})
+
+    def get_market_data_containing(self, contains):
+        return self._close_matrix([market_name for market_name in self.market_names()
+                                   if contains in market_name])
+
+    def get_market_data_by_list(self, market_names):
+        available = set(self.market_names())
+        return self._close_matrix([market_name for market_name in market_names
+                                   if market_name in available])
+
+    def get_coin_data_all(self, market):
+        return self.frame(market)[['close', 'volume', 'time']]
+
+    def close(self):
+        for market in self.markets.values():
+            market.close()
+        self.markets = {}
+        self.manifest_header = None
+        _close_segment(self.manifest_shm)
+
+    def unlink(self):
+        """
+        removes all segments of the store, attached readers keep their mappings
+        """
+        segments = [info['segment'] for info in self._read_manifest()['markets'].values()]
+        self.close()
+        for segment in segments + [self.name]:
+            try:
+                # tracked on purpose, unlink() unregisters it again
+                shm = shared_memory.SharedMemory(name=segment)
+            except FileNotFoundError:
+                continue
+            shm.unlink()
+            shm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+
+def publish_from_database(store, market_names=None):
+    """
+    loads stored tickers into the candle store, all markets if not given
+    """
+    import database
+
+    markets = database.Markets.get_all()
+    if market_names is not None:
+        markets = markets[markets['market_name'].isin(market_names)]
+
+    for _, row in markets.iterrows():
+        data = database.Tickers.get_with_market_id(row['id'])
+        appended = store.append(row['market_name'], row['id'], data)
+        print('{}: {} candles published'.format(row['market_name'], appended))
+
+
+if __name__ == '__main__':
+    name = os.environ.get(STORE_ENV, DEFAULT_NAME)
+    command = sys.argv[1] if len(sys.argv) > 1 else 'publish'
+
+    if command == 'publish':
+        with CandleStore.open(name) as store:
+            publish_from_database(store, sys.argv[2:] or None)
+    elif command == 'unlink':
+        CandleStore.attach(name).unlink()
+        print('Candle store {} removed'.format(name))
+    else:
+        print('usage: candle_store.py [publish [market ...] | unlink]')
@@ -1,4 +1,3 @@
-from sklearn.preprocessing import normalize
 from sklearn.feature_selection import SelectFromModel
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import accuracy_score, classification_report
@@ -6,7 +5,11 @@ from sklearn.model_selection import TimeSeriesSplit
 from sklearn.model_selection import GridSearchCV
 from sklearn.svm import SVC
 from get_collected_data import get_coin_data_all
+from feature_store import (EWM_SPANS, EWM_COLUMNS, RETURN_DELAYS, DELAY_COLUMNS,
+                           FEATURE_COLUMNS, volume_feature, get_features)
 import matplotlib.pyplot as plt
+import metrics
+import pandas as pd
 import pickle
 import time
 
@@ -16,13 +19,19 @@ FEATURE_SEL_PATH = 'models/feature_sel.p'
 
 
 class CryptoClassifier():
-    def __init__(self, data=None, train=False, grid_search=False):
+    def __init__(self, data=None, train=False, grid_search=False, market=None):
+        """
+        trains on data, or on stored features of market when given
+        """
         # initially, all models are None
         self.feature_selector = None
         self.clf = None
 
         if train:
-            if data is not None:
+            if market is not None:
+                self.train_data, self.target_data = self._prepare_stored(market)
+                self.train(grid_search)
+            elif data is not None:
                 self.train_data, self.target_data = self._prepare_data(data)
                 self.train(grid_search)
             else:
@@ -31,32 +40,42 @@ class CryptoClassifier():
             self.load()
 
     @staticmethod
-    def _prepare_data(data):
+    def _prepare_frame(data):
         data = data[['volume', 'close']]
         data['returns'] = data['close'].pct_change()
         data['target'] = data['returns'].shift(-1).map(lambda x: int(x > 0))
 
-        data = CryptoClassifier.feature_generation(data)
-        features = data.drop('target', axis=1).values
+        return CryptoClassifier.feature_generation(data)
+
+    @staticmethod
+    def _prepare_data(data):
+        data = CryptoClassifier._prepare_frame(data)
+        features = data[FEATURE_COLUMNS].values
         target = data['target'].values
         return features, target
 
     @staticmethod
+    def _prepare_stored(market):
+        data = get_features(market)
+        target = data['returns'].shift(-1).map(lambda x: int(x > 0))
+        return data[FEATURE_COLUMNS].values, target.values
+
+    @staticmethod
+    @metrics.timed('classifier.feature_generation')
     def feature_generation(data):
+        # definition shared with feature_store, bump its FEATURE_VERSION on change
         # prepare rolling ewm
-        for momentum in range(10, 200, 20):
-            column = 'ewm_{}'.format(momentum)
+        for momentum, column in zip(EWM_SPANS, EWM_COLUMNS):
             data[column] = data['returns'].ewm(span=momentum, adjust=False).mean()
             # column1 = 'momentum_{}'.format(momentum)
             # data[column1] = data['returns'].rolling(momentum).mean()
 
         # prepare lagged returns
-        for delay in range(1, 20):
-            column = 'delay_return_{}'.format(delay)
+        for delay, column in zip(RETURN_DELAYS, DELAY_COLUMNS):
             data[column] = data['returns'].shift(delay)
 
         # prepare volume data
-        data['volume'] = data['volume'].map(normalize)
+        data['volume'] = volume_feature(data['volume'])
         data.dropna(inplace=True)
         return data
 
@@ -95,16 +114,20 @@ class CryptoClassifier():
             fold_nr += 1
             features_train = self.train_data[train_index]
             target_train = self.target_data[train_index]
-            self.clf.fit(features_train, target_train)
+            with metrics.span('classifier.fit'):
+                self.clf.fit(features_train, target_train)
 
             features_test = self.train_data[test_index]
             target_test = self.target_data[test_index]
-            print('Accuracy:', accuracy_score(target_test, self.clf.predict(features_test)))
+            with metrics.span('classifier.predict'):
+                prediction = self.clf.predict(features_test)
+            print('Accuracy:', accuracy_score(target_test, prediction))
             print('------------------------------------')
             print()
 
         # now train on whole data
-        self.clf.fit(self.train_data, self.target_data)
+        with metrics.span('classifier.fit'):
+            self.clf.fit(self.train_data, self.target_data)
         print('Accuracy on entire train data:', accuracy_score(self.target_data, self.clf.predict(self.train_data)))
         print('Training took {} seconds'.format(time.time() - start_time))
 
@@ -119,10 +142,28 @@ class CryptoClassifier():
         except:
             'Training must be performed before loading!'
 
-    def check_prediction(self, data):
-        features, target = self._prepare_data(data)
+    def predict(self, data):
+        """
+        predicted direction of the next return (1 - up, 0 - down)
+        for rows of data left after feature generation, indexed like data
+        """
+        frame = self._prepare_frame(data)
+        features = self.feature_selector.transform(frame[FEATURE_COLUMNS].values)
+        with metrics.span('classifier.predict'):
+            prediction = self.clf.predict(features)
+        return pd.Series(prediction, index=frame.index)
+
+    def check_prediction(self, data=None, market=None):
+        """
+        classification report on data, or on stored features of market when given
+        """
+        if market is not None:
+            features, target = self._prepare_stored(market)
+        else:
+            features, target = self._prepare_data(data)
         features = self.feature_selector.transform(features)
-        prediction = self.clf.predict(features)
+        with metrics.span('classifier.predict'):
+            prediction = self.clf.predict(features)
 
         print(classification_report(target, prediction))
 
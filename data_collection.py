@@ -1,9 +1,15 @@
 #!/usr/bin/python
+import os
 import pandas as pd
 from bittrex import Bittrex, TICK_INTERVALS
+from candle_store import CandleStore, STORE_ENV
 import database
+import feature_store
+import metrics
+from tick_decoder import decode_candles
 
-columns_mapping = {'C': 'close',
+columns_mapping = {'O': 'open',
+                   'C': 'close',
                    'H': 'high',
                    'L': 'low',
                    'V': 'volume',
@@ -12,6 +18,11 @@ columns_mapping = {'C': 'close',
 
 bittrex_obj = Bittrex()
 
+# path for collapsed stacks of a single profiled collection run
+PROFILE_ENV = 'CRYPTO_PROFILE'
+# any value decodes GetTicks into arrays and stores them with COPY (collect_market_candles_fast)
+FAST_ENV = 'CRYPTO_FAST_COLLECT'
+
 
 def collect_markets():
     markets = bittrex_obj.get_markets()
@@ -22,24 +33,95 @@ def collect_markets():
     database.Markets.save_table(markets_df)
 
 
-def collect_candle_data():
+def candles_to_frame(result, market_id):
+    """
+    GetTicks result as tickers table rows plus open, which only candle store keeps
+    """
+    data = pd.DataFrame(result)[['O', 'C', 'H', 'L', 'V', 'T']].rename(columns=columns_mapping)
+    # GetTicks times are UTC, stored as the same instants as the fast path stores them
+    data['time'] = pd.to_datetime(data['time'], utc=True)
+    data['market_id'] = [market_id] * data.shape[0]
+    return data
+
+
+def collect_market_candles(market_name, market_id):
+    """
+    saves candles of market through DataFrame, returns them or None on failure
+    """
+    get_candles = bittrex_obj.get_candles(market=market_name,
+                                          tick_interval=TICK_INTERVALS['One_Minute'])
+    if not get_candles['success']:
+        return None
+
+    with metrics.span('collector.dataframe'):
+        data = candles_to_frame(get_candles['result'], market_id)
+    database.Tickers.save_table(data.drop('open', axis=1))
+    return data
+
+
+def collect_market_candles_fast(market_name, market_id):
+    """
+    saves candles of market decoded straight into column arrays,
+    returns them or None on failure
+    """
+    payload = bittrex_obj.get_candles(market=market_name,
+                                      tick_interval=TICK_INTERVALS['One_Minute'],
+                                      raw=True)
+    with metrics.span('collector.decode'):
+        columns = decode_candles(payload)
+    if columns is None:
+        return None
+
+    database.Tickers.save_columns(market_id, columns)
+    return columns
+
+
+def collect_candle_data(store=None, fast=False):
+    """
+    saves candles of all markets and extends their stored features,
+    also appends candles to candle store if given
+
+    fast - decode responses straight into arrays instead of DataFrames,
+           stored through COPY on PostgreSQL, off unless CRYPTO_FAST_COLLECT is set
+    """
+    collect_market = collect_market_candles_fast if fast else collect_market_candles
+
     market_data = database.Markets.get_all()
     for _, row in market_data.iterrows():
+        candles = collect_market(row['market_name'], row['id'])
+        if candles is not None:
+            metrics.incr('collector.candles', len(candles['time']))
+            # features are derived data, raw candles of remaining markets come first
+            try:
+                feature_store.update_features(row['id'])
+            except Exception as e:
+                metrics.incr('collector.feature_errors')
+                print('Error {} during feature update of {}'.format(e, row['market_name']))
+            if store is not None:
+                store.append(row['market_name'], row['id'], candles)
+
 
-        get_candles = bittrex_obj.get_candles(market=row['market_name'],
-                                              tick_interval=TICK_INTERVALS['One_Minute'])
-        if get_candles['success']:
-            data = pd.DataFrame(get_candles['result'])[['C', 'H', 'L', 'V', 'T']].rename(columns=columns_mapping)
-            data['market_id'] = [row['id']] * data.shape[0]
-            database.Tickers.save_table(data)
+def collect():
+    collect_markets()
+    fast = bool(os.environ.get(FAST_ENV))
+    if os.environ.get(STORE_ENV):
+        with CandleStore.open(os.environ[STORE_ENV]) as store:
+            collect_candle_data(store, fast=fast)
+    else:
+        collect_candle_data(fast=fast)
 
 
 if __name__ == '__main__':
     try:
-        collect_markets()
-        collect_candle_data()
+        if os.environ.get(PROFILE_ENV):
+            metrics.profile_run(collect, output=os.environ[PROFILE_ENV])
+        else:
+            collect()
         print('Data collected successfully')
 
     except Exception as e:
         print('Error {} during data collection'.format(e))
 
+    if metrics.is_enabled():
+        print(metrics.to_prometheus())
+
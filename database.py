@@ -1,15 +1,27 @@
 #!/usr/bin/python
+import io
+import os
+import numpy as np
 import psycopg2
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects import postgresql, sqlite
 from config_db import config
+import metrics
 import pandas as pd
 
 
 cnf = config()
 
 
+# overrides database.ini, e.g. sqlite:///bench.db for a local stand-in
+DB_URI_ENV = 'CRYPTO_DB_URI'
+
+
 def db_uri():
+    if os.environ.get(DB_URI_ENV):
+        return os.environ[DB_URI_ENV]
+
     return "postgres://{0}:{1}@{2}/{3}".format(cnf['user'],
                                                cnf['password'],
                                                cnf['host'],
@@ -24,6 +36,16 @@ print(db_uri())
 db = SQLAlchemy(app)
 
 
+def read_sql(statement, params=None):
+    """
+    pd.read_sql on the app engine, timed and counted as db.query
+    """
+    with metrics.span('db.query'):
+        df = pd.read_sql(statement, con=db.engine, params=params)
+    metrics.incr('db.rows_read', df.shape[0])
+    return df
+
+
 class Markets(db.Model):
     __tablename__ = 'markets'
     id = db.Column(db.INTEGER, primary_key=True)
@@ -54,19 +76,15 @@ class Markets(db.Model):
 
     @staticmethod
     def get_market_name_contains(contains):
-        return pd.read_sql(Markets.query.filter(Markets.market_name.contains(contains)).statement,
-                           con=db.engine)
+        return read_sql(Markets.query.filter(Markets.market_name.contains(contains)).statement)
 
     @staticmethod
     def get_market_id_with_names(market_names):
-        return pd.read_sql(Markets.query.filter(Markets.market_name.in_(market_names)).statement,
-                           con=db.engine)
+        return read_sql(Markets.query.filter(Markets.market_name.in_(market_names)).statement)
 
     @staticmethod
     def get_all():
-        return pd.read_sql_table('markets',
-                                 db.engine,
-                                 columns=['id', 'market_name'])
+        return read_sql(db.select([Markets.id, Markets.market_name]))
 
 
 class Tickers(db.Model):
@@ -94,26 +112,83 @@ class Tickers(db.Model):
 
     @staticmethod
     def save_table(df):
-        df.to_sql('tickers',
-                  con=db.engine,
-                  if_exists='append',
-                  index=False)
+        with metrics.span('db.save_table'):
+            df.to_sql('tickers',
+                      con=db.engine,
+                      if_exists='append',
+                      index=False)
+        metrics.incr('db.rows_written', df.shape[0])
         print('table successfully updated')
 
+    @staticmethod
+    def save_columns(market_id, columns):
+        """
+        bulk insert of typed candle columns (tick_decoder.decode_candles),
+        COPY on PostgreSQL, pandas insert on other databases
+
+        times are written as explicit UTC instants ('...Z'), the same instants
+        collect_market_candles stores through save_table
+        """
+        names = ['close', 'high', 'low', 'volume']
+        n = columns['time'].shape[0]
+
+        with metrics.span('db.save_table'):
+            if db.engine.name == 'postgresql':
+                values = np.empty((n, len(names) + 1), dtype=object)
+                for i, name in enumerate(names):
+                    values[:, i] = columns[name]
+                values[:, -1] = np.datetime_as_string(columns['time'].astype('datetime64[s]'), timezone='UTC')
+                # whole buffer formatted by one call, no per row tuples or joins
+                row = '\t'.join(['%s'] * values.shape[1]) + '\t{}\n'.format(int(market_id))
+                buffer = io.StringIO((row * n) % tuple(values.ravel().tolist()))
+
+                connection = db.engine.raw_connection()
+                try:
+                    cursor = connection.cursor()
+                    cursor.copy_from(buffer, 'tickers', columns=names + ['time', 'market_id'])
+                    connection.commit()
+                finally:
+                    connection.close()
+            else:
+                df = pd.DataFrame({name: columns[name] for name in names}, columns=names)
+                df['time'] = pd.to_datetime(columns['time'], unit='s', utc=True)
+                df['market_id'] = int(market_id)
+                df.to_sql('tickers', con=db.engine, if_exists='append', index=False)
+        metrics.incr('db.rows_written', n)
+
     @staticmethod
     def get_with_market_id(market_id):
-        return pd.read_sql(Tickers.query.filter_by(market_id=market_id).statement,
-                           con=db.engine)
+        return read_sql(Tickers.query.filter_by(market_id=market_id).statement)
 
     @staticmethod
     def get_with_market_id_all(market_id):
-        return pd.read_sql(Tickers.query.filter_by(market_id=market_id).statement,
-                           con=db.engine)
+        return read_sql(Tickers.query.filter_by(market_id=market_id).statement)
+
+    @staticmethod
+    def get_with_market_id_between(market_id, start=None, end=None):
+        """
+        tickers of market ordered by time, start inclusive, end exclusive,
+        re-fetched copies of a candle ordered by id, so the newest comes last
+        """
+        query = Tickers.query.filter_by(market_id=market_id)
+        if start is not None:
+            query = query.filter(Tickers.time >= start)
+        if end is not None:
+            query = query.filter(Tickers.time < end)
+        return read_sql(query.order_by(Tickers.time, Tickers.id).statement)
+
+    @staticmethod
+    def get_last_id():
+        """
+        id of the newest stored ticker, ingestion watermark:
+        grows with every insert, read from the primary key index
+        """
+        with metrics.span('db.query'):
+            return db.session.query(db.func.max(Tickers.id)).scalar()
 
     @staticmethod
     def get_coins_with_ids(ids):
-        return pd.read_sql(Tickers.query.filter(Tickers.market_id.in_(ids)).statement,
-                           con=db.engine)[['market_id', 'close', 'time']]
+        return read_sql(Tickers.query.filter(Tickers.market_id.in_(ids)).statement)[['market_id', 'close', 'time']]
 
 
     @staticmethod
@@ -122,8 +197,93 @@ class Tickers(db.Model):
 
     @staticmethod
     def get_all():
-        return pd.read_sql_table('tickers',
-                                 db.engine)
+        return read_sql(Tickers.query.statement)
+
+
+def _insert_ignoring_duplicates(table, conn, keys, data_iter):
+    """
+    pandas to_sql method, rows conflicting with a unique key are skipped
+    """
+    rows = [dict(zip(keys, row)) for row in data_iter]
+    if conn.dialect.name == 'postgresql':
+        statement = postgresql.insert(table.table).on_conflict_do_nothing()
+    elif conn.dialect.name == 'sqlite':
+        statement = sqlite.insert(table.table).on_conflict_do_nothing()
+    else:
+        statement = table.table.insert()
+    conn.execute(statement, rows)
+
+
+class Features(object):
+    """
+    Materialized classifier features, one table per feature version.
+    Columns follow feature_store.FEATURE_COLUMNS next to market_id, time and
+    feature_version, which form the unique key of a table.
+    """
+
+    # tables known to exist with their key, created at most once per process
+    created = set()
+
+    @staticmethod
+    def table_name(version):
+        return 'features_v{}'.format(version)
+
+    @staticmethod
+    def create_table(columns, version):
+        """
+        creates table of version keyed by (market_id, time, feature_version),
+        other columns as floats
+        """
+        name = Features.table_name(version)
+        if name in Features.created:
+            return
+        keys = ['market_id', 'time', 'feature_version']
+        table = db.Table(name, db.MetaData(),
+                         db.Column('market_id', db.INTEGER, nullable=False),
+                         db.Column('time', db.DateTime(timezone=True), nullable=False),
+                         db.Column('feature_version', db.INTEGER, nullable=False),
+                         db.Index('{}_key'.format(name), *keys, unique=True),
+                         *[db.Column(column, db.Float) for column in columns if column not in keys])
+        table.create(db.engine, checkfirst=True)
+        Features.created.add(name)
+
+    @staticmethod
+    def save_table(df, version):
+        """
+        appends feature rows, rows already stored (e.g. by a concurrent run) are skipped
+        """
+        Features.create_table(df.columns, version)
+        with metrics.span('features.save_table'):
+            df.to_sql(Features.table_name(version),
+                      con=db.engine,
+                      if_exists='append',
+                      index=False,
+                      method=_insert_ignoring_duplicates)
+        metrics.incr('features.rows_written', df.shape[0])
+
+    @staticmethod
+    def get_with_market_id(market_id, version):
+        """
+        stored features of market ordered by time, empty if none were computed
+        """
+        table = Features.table_name(version)
+        if not db.engine.has_table(table):
+            return pd.DataFrame()
+        return read_sql(db.text('SELECT * FROM {} WHERE market_id = :market_id ORDER BY time'.format(table)),
+                        params={'market_id': int(market_id)})
+
+    @staticmethod
+    def get_last(market_id, version):
+        """
+        newest stored feature row of market as Series, None if none were computed
+        """
+        table = Features.table_name(version)
+        if not db.engine.has_table(table):
+            return None
+        df = read_sql(db.text('SELECT * FROM {} WHERE market_id = :market_id '
+                              'ORDER BY time DESC LIMIT 1'.format(table)),
+                      params={'market_id': int(market_id)})
+        return df.iloc[0] if df.shape[0] else None
 
 
 def test_connection():
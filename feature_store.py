@@ -0,0 +1,124 @@
+#!/usr/bin/python
+"""
+Materialized CryptoClassifier features.
+
+Features of every market are stored in features_v<FEATURE_VERSION> keyed by
+(market_id, time, feature_version) and extended after each collection run
+from the newest stored row: its close, EWM values and lagged returns are the
+whole state needed to continue. Bumping FEATURE_VERSION after changing the
+definition below starts a new table, which is then recomputed from tickers.
+"""
+import pandas as pd
+from sklearn.preprocessing import normalize
+
+import database
+import metrics
+
+
+# bump whenever the definition below changes, 2: tables keyed by (market_id, time, feature_version)
+FEATURE_VERSION = 2
+
+EWM_SPANS = range(10, 200, 20)
+RETURN_DELAYS = range(1, 20)
+
+EWM_COLUMNS = ['ewm_{}'.format(span) for span in EWM_SPANS]
+DELAY_COLUMNS = ['delay_return_{}'.format(delay) for delay in RETURN_DELAYS]
+FEATURE_COLUMNS = ['volume', 'close', 'returns'] + EWM_COLUMNS + DELAY_COLUMNS
+
+
+def volume_feature(volume):
+    """
+    every volume normalized on its own, as classifier always did it
+    """
+    return normalize(volume.values.reshape(-1, 1).astype(float))[:, 0]
+
+
+def _carry(last_value, values):
+    # last_value prepended, so recursive/shifted computations continue from it
+    return pd.concat([pd.Series([last_value]), values], ignore_index=True)
+
+
+def compute_features(tickers, last=None):
+    """
+    Arguments:
+        tickers - volume, close and time of one market, newer than last
+        last - newest stored feature row of the market, None on first build
+
+    Returns:
+        DataFrame with time and FEATURE_COLUMNS, rows without full history dropped
+    """
+    data = tickers[['volume', 'close', 'time']].drop_duplicates('time', keep='last')
+    data = data.sort_values('time').reset_index(drop=True)
+    close = data['close'].astype(float)
+
+    if last is None:
+        returns = close.pct_change()
+    else:
+        returns = _carry(last['close'], close).pct_change()[1:].reset_index(drop=True)
+
+    features = pd.DataFrame({'time': data['time'],
+                             'volume': volume_feature(data['volume']),
+                             'close': close,
+                             'returns': returns})
+
+    for span, column in zip(EWM_SPANS, EWM_COLUMNS):
+        if last is None:
+            features[column] = returns.ewm(span=span, adjust=False).mean()
+        else:
+            features[column] = _carry(last[column], returns).ewm(span=span, adjust=False).mean()[1:].values
+
+    # chronological returns before the first new one, oldest first
+    if last is None:
+        history = returns
+    else:
+        previous = [last[column] for column in reversed(DELAY_COLUMNS[:-1])] + [last['returns']]
+        history = pd.concat([pd.Series(previous), returns], ignore_index=True)
+    offset = history.shape[0] - returns.shape[0]
+    for delay, column in zip(RETURN_DELAYS, DELAY_COLUMNS):
+        features[column] = history.shift(delay)[offset:].values
+
+    return features[['time'] + FEATURE_COLUMNS].dropna()
+
+
+def update_features(market_id, version=FEATURE_VERSION):
+    """
+    extends stored features of market with tickers newer than the last stored row,
+    returns number of new rows
+    """
+    with metrics.span('features.update'):
+        last = database.Features.get_last(market_id, version)
+        tickers = database.Tickers.get_with_market_id_between(market_id,
+                                                              start=None if last is None else last['time'])
+        if last is not None:
+            tickers = tickers[tickers['time'] > last['time']]
+        if tickers.empty:
+            return 0
+
+        features = compute_features(tickers, last)
+        features.insert(0, 'feature_version', version)
+        features.insert(0, 'market_id', int(market_id))
+        database.Features.save_table(features, version)
+
+    return features.shape[0]
+
+
+def get_features(market, version=FEATURE_VERSION):
+    """
+    stored features of market (name or id) ordered by time,
+    built first if this feature version was never computed for it
+    """
+    market_id = database.Markets.get_by_market_name(market) if isinstance(market, str) else market
+
+    features = database.Features.get_with_market_id(market_id, version)
+    if features.empty and update_features(market_id, version):
+        features = database.Features.get_with_market_id(market_id, version)
+    return features.reindex(columns=['time'] + FEATURE_COLUMNS)
+
+
+def update_all(version=FEATURE_VERSION):
+    for _, row in database.Markets.get_all().iterrows():
+        print('{}: {} feature rows added'.format(row['market_name'], update_features(row['id'], version)))
+
+
+if __name__ == '__main__':
+    update_all()
@@ -1,16 +1,39 @@
+import os
 import pandas as pd
+from candle_store import CandleStore, STORE_ENV
 import database
 
 
+_candle_store = None
+
+
+def candle_store():
+    """
+    attached CandleStore when CRYPTO_CANDLE_STORE names one, None otherwise;
+    it holds the last `capacity` candles of every market, database keeps all
+    """
+    global _candle_store
+    if _candle_store is None and os.environ.get(STORE_ENV):
+        try:
+            _candle_store = CandleStore.attach(os.environ[STORE_ENV])
+        except FileNotFoundError:
+            print('Candle store {} not published, reading database'.format(os.environ[STORE_ENV]))
+    return _candle_store
+
+
 def get_coin_data_closing(coin):
     """
     retrieves data for specific coin, based on its name (market-name)
     """
+    if candle_store() is not None:
+        return candle_store().get_coin_data_closing(coin)
     market_id = database.Markets.get_by_market_name(coin)
     return database.Tickers.get_with_market_id(market_id).rename(columns={'close': coin})
 
 
 def get_market_data_containing(contains):
+    if candle_store() is not None:
+        return candle_store().get_market_data_containing(contains)
     market_ids = database.Markets.get_market_name_contains(contains)
     df_all = pd.DataFrame()
 
@@ -27,6 +50,8 @@ def get_market_data_containing(contains):
 
 
 def get_market_data_by_list(market_names):
+    if candle_store() is not None:
+        return candle_store().get_market_data_by_list(market_names)
     market_ids = database.Markets.get_market_id_with_names(market_names)
     df_all = pd.DataFrame()
 
@@ -42,6 +67,8 @@ def get_market_data_by_list(market_names):
 
 
 def get_coin_data_all(market):
+    if candle_store() is not None:
+        return candle_store().get_coin_data_all(market)
     market_id = database.Markets.get_by_market_name(market)
     data = database.Tickers.get_with_market_id(market_id)
     return data[['close', 'volume', 'time']]
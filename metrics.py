@@ -0,0 +1,253 @@
+#!/usr/bin/python
+"""
+Lightweight timing spans and counters for the hot paths
+(collector, database, classifier).
+
+Disabled by default, a disabled span or counter is a single flag check.
+Enable with CRYPTO_METRICS=1 in the environment or metrics.enable().
+
+    with metrics.span('db.save_table'):
+        ...
+    metrics.incr('db.rows_written', len(df))
+
+    print(metrics.to_prometheus())
+    metrics.log_json()
+"""
+import collections
+import functools
+import json
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+
+
+METRICS_ENV = 'CRYPTO_METRICS'
+PROMETHEUS_PREFIX = 'crypto_'
+
+logger = logging.getLogger('crypto.metrics')
+
+_enabled = os.environ.get(METRICS_ENV, '') not in ('', '0')
+_lock = threading.Lock()
+
+# name -> value
+_counters = collections.defaultdict(float)
+# name -> [count, total seconds, max seconds]
+_timers = collections.defaultdict(lambda: [0, 0.0, 0.0])
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _timers.clear()
+
+
+def incr(name, value=1):
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] += value
+
+
+def observe(name, seconds):
+    if not _enabled:
+        return
+    with _lock:
+        timer = _timers[name]
+        timer[0] += 1
+        timer[1] += seconds
+        if seconds > timer[2]:
+            timer[2] = seconds
+
+
+class _Span(object):
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        observe(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class _NullSpan(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(name):
+    """
+    context manager timing its block under given name
+    """
+    if not _enabled:
+        return _NULL_SPAN
+    return _Span(name)
+
+
+def timed(name):
+    """
+    decorator timing every call of the function under given name
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _Span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def snapshot():
+    """
+    current values as plain dict:
+        {'counters': {name: value},
+         'timers': {name: {'count', 'total_s', 'max_s'}}}
+    """
+    with _lock:
+        return {'counters': dict(_counters),
+                'timers': {name: {'count': count, 'total_s': total, 'max_s': max_s}
+                           for name, (count, total, max_s) in _timers.items()}}
+
+
+def _prometheus_name(name):
+    return PROMETHEUS_PREFIX + ''.join(c if c.isalnum() else '_' for c in name)
+
+
+def to_prometheus():
+    """
+    Prometheus text exposition format, counters as *_total,
+    timers as *_seconds summaries (count, sum) plus *_seconds_max gauge
+    """
+    values = snapshot()
+    lines = []
+    for name, value in sorted(values['counters'].items()):
+        metric = _prometheus_name(name) + '_total'
+        lines.append('# TYPE {} counter'.format(metric))
+        lines.append('{} {!r}'.format(metric, value))
+
+    for name, timer in sorted(values['timers'].items()):
+        metric = _prometheus_name(name) + '_seconds'
+        lines.append('# TYPE {} summary'.format(metric))
+        lines.append('{}_count {}'.format(metric, timer['count']))
+        lines.append('{}_sum {!r}'.format(metric, timer['total_s']))
+        lines.append('# TYPE {}_max gauge'.format(metric))
+        lines.append('{}_max {!r}'.format(metric, timer['max_s']))
+
+    return '\n'.join(lines) + '\n'
+
+
+def to_json():
+    values = snapshot()
+    values['timestamp'] = time.time()
+    return json.dumps(values, sort_keys=True)
+
+
+def log_json(level=logging.INFO):
+    """
+    emits one structured log record per metric
+    """
+    values = snapshot()
+    for name, value in sorted(values['counters'].items()):
+        logger.log(level, json.dumps({'metric': name, 'type': 'counter', 'value': value}))
+    for name, timer in sorted(values['timers'].items()):
+        record = {'metric': name, 'type': 'timer'}
+        record.update(timer)
+        logger.log(level, json.dumps(record))
+
+
+class SamplingProfiler(object):
+    """
+    Samples the main thread stack every interval seconds of CPU time
+    (SIGPROF, unix only) and aggregates collapsed stacks,
+    the format flamegraph.pl and speedscope read.
+
+        with metrics.SamplingProfiler() as profiler:
+            collect_candle_data()
+        profiler.write('collect.folded')
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = collections.Counter()
+        self._previous_handler = None
+
+    def _sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append('{}:{}'.format(os.path.basename(code.co_filename), code.co_name))
+            frame = frame.f_back
+        self.samples[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self._previous_handler = signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, self._previous_handler or signal.SIG_DFL)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+        return False
+
+    def collapsed(self):
+        return '\n'.join('{} {}'.format(stack, count)
+                         for stack, count in self.samples.most_common())
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            f.write(self.collapsed() + '\n')
+
+
+def profile_run(func, *args, output=None, interval=0.005, **kwargs):
+    """
+    runs func once under SamplingProfiler, writes collapsed stacks
+    to output (stderr if not given) even when func raises,
+    returns func result
+    """
+    profiler = SamplingProfiler(interval)
+    try:
+        with profiler:
+            return func(*args, **kwargs)
+    finally:
+        # failing runs are written too, they are the interesting ones
+        if output:
+            profiler.write(output)
+        else:
+            sys.stderr.write(profiler.collapsed() + '\n')
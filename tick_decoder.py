@@ -0,0 +1,48 @@
+#!/usr/bin/python
+"""
+Fast path for GetTicks responses: raw JSON bytes are parsed (orjson or
+ujson when installed), which still builds a dict per candle, and the
+candle fields are gathered into typed column arrays without building a
+DataFrame.
+"""
+from operator import itemgetter
+
+import numpy as np
+
+try:
+    from orjson import loads
+except ImportError:
+    try:
+        from ujson import loads
+    except ImportError:
+        from json import loads
+
+
+# GetTicks field -> column, open only goes to the candle store
+FIELDS = {'O': 'open',
+          'C': 'close',
+          'H': 'high',
+          'L': 'low',
+          'V': 'volume'}
+
+
+def decode_candles(payload):
+    """
+    Arguments:
+        payload - raw GetTicks response body
+
+    Returns:
+        dict of float64 open/close/high/low/volume and int64 epoch seconds time arrays,
+        None when request was not successful
+    """
+    response = loads(payload)
+    if not response.get('success'):
+        return None
+
+    result = response['result'] or []
+    n = len(result)
+    columns = {column: np.fromiter(map(itemgetter(field), result), dtype=np.float64, count=n)
+               for field, column in FIELDS.items()}
+    # numpy parses ISO times ('2016-04-08T00:00:00', UTC) in C
+    columns['time'] = np.array(list(map(itemgetter('T'), result)), dtype='datetime64[s]').astype(np.int64)
+    return columns